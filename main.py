@@ -7,19 +7,75 @@ OptiMax API — Cleaned Full Version
 - Ensures clarity without altering functionality
 """
 
-from fastapi import FastAPI, Request
-from notion_client import Client
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from notion_client import AsyncClient, APIResponseError
+from aiolimiter import AsyncLimiter
+from cachetools import TTLCache
+import httpx
 from dotenv import load_dotenv
-import os, datetime, re, random
-from schemas import CreatePageRequest, AppendRequest, UpdateTitleRequest
+import os, sys, datetime, re, random, asyncio, functools, hmac
+import orjson
+from contextlib import aclosing, asynccontextmanager
+from contextvars import ContextVar
+from schemas import (
+    CreatePageRequest,
+    AppendRequest,
+    BatchAppendRequest,
+    UpdateTitleRequest,
+    PageActionRequest,
+    SyncStructureRequest,
+    TemplateRequest,
+    BootstrapResponse,
+)
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import FastAPI
 
+try:
+    import ahocorasick  # optional: pyahocorasick speeds up summarize_entries
+except ImportError:
+    ahocorasick = None
+
 # -------------------------------------------------
 # Environment Setup
 # -------------------------------------------------
 load_dotenv()
+
+
+@asynccontextmanager
+async def lifespan(app):
+    try:
+        http_version = await probe_http_version()
+        if http_version != "HTTP/2":
+            print(f"⚠️ Notion connection negotiated {http_version}, not HTTP/2")
+    except Exception as e:
+        print(f"⚠️ Could not probe the Notion connection: {e}")
+    load_child_page_cache()
+    try:
+        await resolve_log_page_ids()
+    except Exception as e:
+        print(f"⚠️ Could not resolve log pages at startup: {e}")
+    log_flusher = asyncio.create_task(flush_logs())
+    brand_warmup = asyncio.create_task(warm_brand_cache())
+    yield
+    # Shielded listings and reads outlive the warm-up; stop them before saving.
+    in_flight = [
+        *_child_page_listings.values(),
+        *(read for read in _read_page_cache.values() if not read.done()),
+    ]
+    for task in (brand_warmup, *in_flight):
+        task.cancel()
+    await asyncio.gather(brand_warmup, *in_flight, return_exceptions=True)
+    # The sentinel makes the flusher write what is still queued before exiting.
+    _log_queue.put_nowait(None)
+    await log_flusher
+    save_child_page_cache()
+    await notion.aclose()
+
+
 app = FastAPI(
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
     title="OptiMax Notion API",
     version="1.0.0",
     servers=[{"url": "https://api.optimaxmybiz.com"}],
@@ -34,8 +90,13 @@ app.add_middleware(
 )
 
 
+# Formatted once per request by the middleware below and reused by timestamp().
+request_ts: ContextVar[str | None] = ContextVar("request_ts", default=None)
+
+
 @app.middleware("http")
 async def log_incoming_requests(request, call_next):
+    request_ts.set(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
     print(f"📩 Incoming request: {request.method} {request.url}")
     print(f"Headers: {request.headers}")
     response = await call_next(request)
@@ -43,77 +104,389 @@ async def log_incoming_requests(request, call_next):
     return response
 
 
-notion = Client(auth=os.getenv("NOTION_API_KEY"))
+NOTION_API_KEY = os.getenv("NOTION_API_KEY")
 MAIN_PAGE_ID = os.getenv("MAIN_PAGE_ID")
 
+# Idle connections kept 30s (httpx default 5s) to survive gaps between bursts.
+notion = AsyncClient(
+    auth=NOTION_API_KEY,
+    client=httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(
+            max_connections=32, max_keepalive_connections=32, keepalive_expiry=30
+        ),
+    ),
+    timeout_ms=30_000,
+)
+
+# Upper bound on in-flight Notion requests when fanning out with gather.
+NOTION_CONCURRENCY = 8
+_notion_semaphore = asyncio.Semaphore(NOTION_CONCURRENCY)
+# Notion's average limit is 3 requests/s; 429s still honour Retry-After.
+_notion_rate = AsyncLimiter(3, 1)
+NOTION_MAX_RETRIES = 5
+
+# A title missing from a parent in _listed_parents does not exist yet.
+_child_page_cache: dict[str, dict[str, str]] = {}
+_listed_parents: set[str] = set()
+# Where paging a partially listed parent stopped, so the next miss resumes.
+_child_page_cursors: dict[str, str] = {}
+# parent_id -> in-flight listing; awaited shielded, so one caller can't cancel it.
+_child_page_listings: dict[str, asyncio.Future] = {}
+# Bumped when the hub's children change; part of match_hub_title's LRU key.
+_hub_version = 0
+# Entries loaded from here count as seen, not as fully listed.
+CHILD_PAGE_CACHE_FILE = os.getenv("CHILD_PAGE_CACHE_FILE", ".child_page_cache.json")
+
+# log_action enqueues; flush_logs appends up to LOG_BATCH_SIZE per call.
+LOG_BATCH_SIZE = 50
+# Notion accepts at most this many blocks in one blocks.children.append call.
+APPEND_BLOCK_LIMIT = 100
+LOG_FLUSH_INTERVAL = 0.5
+_log_queue: asyncio.Queue = asyncio.Queue()
+
+# Pages under the hub's "Activity Log"; LOG_PAGE_IDS is filled at startup.
+LOG_PAGE_TITLES = ("Daily Log", "Agent Logs", "Human Logs", "Archive")
+LOG_PAGE_IDS: dict[str, str] = {}
+# Entries /summarize_activity reads by default: one page of the Daily Log.
+SUMMARY_ENTRY_LIMIT = 100
+
+# page_id -> shielded retrieval task shared by concurrent and repeated reads.
+READ_PAGE_TTL = 30
+_read_page_cache: TTLCache = TTLCache(maxsize=1024, ttl=READ_PAGE_TTL)
+
 
 # -------------------------------------------------
 # Helper Functions
 # -------------------------------------------------
 def timestamp():
-    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return request_ts.get() or datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def paragraph_block(text: str):
+    return {
+        "object": "block",
+        "type": "paragraph",
+        "paragraph": {"rich_text": [{"type": "text", "text": {"content": text}}]},
+    }
+
+
+async def call_notion(method, **kwargs):
+    for attempt in range(NOTION_MAX_RETRIES + 1):
+        async with _notion_semaphore, _notion_rate:
+            try:
+                return await method(**kwargs)
+            except APIResponseError as e:
+                if e.status != 429 or attempt == NOTION_MAX_RETRIES:
+                    raise
+                retry_after = float(e.headers.get("Retry-After", 1))
+        print(f"⏳ Rate limited by Notion; retrying in {retry_after}s")
+        await asyncio.sleep(retry_after)
 
 
-def confirm_pin(change_type, target):
+async def probe_http_version() -> str:
+    # Anything but HTTP/2 means requests are not multiplexed.
+    response = await notion.client.head(notion.options.base_url)
+    return response.http_version
+
+
+def confirm_pin(change_type, target, pin: str | None = None):
     if change_type == "major":
-        entered = input(
-            f"\n⚠️  MAJOR edit requested for '{target}'. Enter PIN to approve: "
-        )
+        print(f"⚠️  MAJOR edit requested for '{target}'.")
         agent_key = os.getenv("AGENT_AUTH_KEY", "")
         if not agent_key:
             print("⚠️ No AGENT_AUTH_KEY set; rejecting by default.")
-            raise PermissionError("Denied: no PIN configured.")
-        if entered != agent_key:
+            raise HTTPException(status_code=403, detail="Denied: no PIN configured.")
+        if not pin or not hmac.compare_digest(pin.encode(), agent_key.encode()):
             print("❌ Edit denied: invalid PIN.")
-            raise PermissionError("Denied: invalid PIN.")
+            raise HTTPException(status_code=403, detail="Denied: invalid PIN.")
         print("✅ Edit approved.")
     else:
         print(f"ℹ️ Minor edit queued for '{target}' (no PIN required).")
 
 
-def list_child_pages(parent_page_id: str):
-    results, cursor = {}, None
+def hub_changed(parent_id: str | None = None):
+    global _hub_version
+    if parent_id is None or parent_id == MAIN_PAGE_ID:
+        _hub_version += 1
+
+
+def invalidate_cache(parent_id: str | None = None):
+    if parent_id is None:
+        _child_page_cache.clear()
+        _listed_parents.clear()
+        _child_page_cursors.clear()
+    else:
+        _child_page_cache.pop(parent_id, None)
+        _listed_parents.discard(parent_id)
+        _child_page_cursors.pop(parent_id, None)
+    hub_changed(parent_id)
+
+
+def load_child_page_cache():
+    try:
+        with open(CHILD_PAGE_CACHE_FILE, "rb") as f:
+            saved = orjson.loads(f.read())
+    except FileNotFoundError:
+        return
+    except Exception as e:
+        print(f"⚠️ Ignoring unreadable child page cache: {e}")
+        return
+    if not valid_child_page_cache(saved):
+        print("⚠️ Ignoring malformed child page cache")
+        return
+    # Entries already listed live win over the possibly stale file.
+    for parent_id, children in saved.items():
+        known = _child_page_cache.setdefault(parent_id, {})
+        for title, page_id in children.items():
+            known.setdefault(sys.intern(title), page_id)
+    hub_changed()
+
+
+def valid_child_page_cache(saved) -> bool:
+    # The saved cache must be {parent_id: {title: page_id}} with string ids.
+    return isinstance(saved, dict) and all(
+        isinstance(children, dict)
+        and all(isinstance(page_id, str) for page_id in children.values())
+        for children in saved.values()
+    )
+
+
+def save_child_page_cache():
+    # Written to a temporary file first so a crash never leaves a torn cache.
+    tmp_path = f"{CHILD_PAGE_CACHE_FILE}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(orjson.dumps(_child_page_cache))
+        os.replace(tmp_path, CHILD_PAGE_CACHE_FILE)
+    except Exception as e:
+        print(f"⚠️ Could not save child page cache: {e}")
+
+
+def remember_child_page(parent_page_id: str, title: str, page_id: str):
+    if parent_page_id in _child_page_cache:
+        _child_page_cache[parent_page_id][title] = page_id
+        hub_changed(parent_page_id)
+    # A freshly created page has no children yet.
+    _child_page_cache[page_id] = {}
+    _listed_parents.add(page_id)
+
+
+async def fetch_child_pages(parent_page_id: str, cursor: str | None = None):
+    # One page of children: ({title: page id}, next cursor or None when done).
+    resp = await call_notion(
+        notion.blocks.children.list,
+        block_id=parent_page_id,
+        start_cursor=cursor,
+        page_size=100,
+    )
+    pages = {
+        sys.intern(block["child_page"]["title"]): block["id"]
+        for block in resp["results"]
+        if block["type"] == "child_page"
+    }
+    return pages, resp["next_cursor"] if resp["has_more"] else None
+
+
+async def list_child_pages(parent_page_id: str):
+    results, cursor = await fetch_child_pages(parent_page_id)
+    while cursor:
+        pages, cursor = await fetch_child_pages(parent_page_id, cursor)
+        results.update(pages)
+    _child_page_cache[parent_page_id] = results
+    _listed_parents.add(parent_page_id)
+    _child_page_cursors.pop(parent_page_id, None)
+    hub_changed(parent_page_id)
+    return results
+
+
+async def cached_child_pages(
+    parent_page_id: str, wanted: set[str] | None = None
+) -> dict[str, str]:
+    # Pages only until every title in `wanted` is known (None: to the end).
+    while True:
+        known = _child_page_cache.setdefault(parent_page_id, {})
+        if parent_page_id in _listed_parents or (
+            wanted is not None and known.keys() >= wanted
+        ):
+            return known
+        listing = _child_page_listings.get(parent_page_id)
+        if listing is None or listing.done():
+            listing = asyncio.ensure_future(page_child_pages(parent_page_id, wanted))
+            _child_page_listings[parent_page_id] = listing
+            listing.add_done_callback(
+                functools.partial(forget_child_page_listing, parent_page_id)
+            )
+        await asyncio.shield(listing)
+
+
+def forget_child_page_listing(parent_page_id: str, listing: asyncio.Future):
+    if _child_page_listings.get(parent_page_id) is listing:
+        del _child_page_listings[parent_page_id]
+
+
+async def page_child_pages(parent_page_id: str, wanted: set[str] | None):
+    # Drops the result if invalidate_cache replaced `known` mid-listing.
+    known = _child_page_cache.setdefault(parent_page_id, {})
+    cursor = _child_page_cursors.pop(parent_page_id, None)
+    while wanted is None or not known.keys() >= wanted:
+        pages, cursor = await fetch_child_pages(parent_page_id, cursor)
+        if _child_page_cache.get(parent_page_id) is not known:
+            return
+        known.update(pages)
+        hub_changed(parent_page_id)
+        if cursor is None:
+            _listed_parents.add(parent_page_id)
+            return
+    if cursor is not None:
+        _child_page_cursors[parent_page_id] = cursor
+
+
+async def find_child_page(parent_page_id: str, title: str) -> str | None:
+    known = await cached_child_pages(parent_page_id, {title})
+    return known.get(title)
+
+
+def page_title(page) -> str:
+    for prop in page.get("properties", {}).values():
+        if prop.get("type") == "title":
+            return sys.intern("".join(part["plain_text"] for part in prop["title"]))
+    return ""
+
+
+async def prime_tree() -> dict[str, dict[str, str]]:
+    # Search can lag behind edits, so seeded parents are not marked listed.
+    tree: dict[str, dict[str, str]] = {}
+    hub_key = (MAIN_PAGE_ID or "").replace("-", "")
+    cursor = None
     while True:
-        resp = notion.blocks.children.list(block_id=parent_page_id, start_cursor=cursor)
-        for block in resp.get("results", []):
-            if block.get("type") == "child_page":
-                title = block["child_page"]["title"]
-                results[title] = block
+        resp = await call_notion(
+            notion.search,
+            filter={"property": "object", "value": "page"},
+            start_cursor=cursor,
+            page_size=100,
+        )
+        for page in resp.get("results", []):
+            parent = page.get("parent", {})
+            if parent.get("type") != "page_id" or page.get("archived"):
+                continue
+            parent_id = parent["page_id"]
+            if parent_id.replace("-", "") == hub_key:
+                parent_id = MAIN_PAGE_ID
+            tree.setdefault(parent_id, {})[page_title(page)] = page["id"]
         if not resp.get("has_more"):
             break
         cursor = resp.get("next_cursor")
-    return results
+    for parent_id, children in tree.items():
+        if parent_id not in _listed_parents:
+            _child_page_cache.setdefault(parent_id, {}).update(children)
+            hub_changed(parent_id)
+    return tree
+
+
+def rename_child_page(page_id: str, new_title: str):
+    for children in _child_page_cache.values():
+        for title, child_id in list(children.items()):
+            if child_id == page_id:
+                del children[title]
+                children[new_title] = page_id
+    hub_changed()
+
+
+_PAGE_ID_RE = re.compile(r"[0-9a-fA-F]{32}")
+
+
+@functools.lru_cache(maxsize=512)
+def match_hub_title(identifier_lower: str, hub_version: int) -> str | None:
+    for title, page_id in _child_page_cache.get(MAIN_PAGE_ID, {}).items():
+        if title.lower() == identifier_lower:
+            return page_id
+    return None
+
+
+async def resolve_page_id(identifier: str) -> str:
+    # Page IDs pass through; other identifiers are matched as hub titles.
+    if _PAGE_ID_RE.fullmatch(identifier.replace("-", "")):
+        return identifier
+    for _ in range(2):
+        # A miss against an earlier listing may be a page added since: re-list once.
+        relist = MAIN_PAGE_ID in _listed_parents
+        pages = await cached_child_pages(MAIN_PAGE_ID)
+        page_id = pages.get(identifier) or match_hub_title(
+            identifier.lower(), _hub_version
+        )
+        if page_id or not relist:
+            break
+        invalidate_cache(MAIN_PAGE_ID)
+    return page_id or identifier
 
 
 def log_action(action: str, target: str = "", status: str = "", level: str = "INFO"):
+    content = f"[{timestamp()}] {action} | target: {target} | status: {status}"
+    _log_queue.put_nowait(content)
+    print(f"LOG [{level}]: {action} | {target} | {status}")
+
+
+async def resolve_log_page_ids():
+    activity_log = await ensure_child_page(MAIN_PAGE_ID, "Activity Log")
+    await cached_child_pages(activity_log, set(LOG_PAGE_TITLES))
+    ids = await asyncio.gather(
+        *[ensure_child_page(activity_log, title) for title in LOG_PAGE_TITLES]
+    )
+    LOG_PAGE_IDS["Activity Log"] = activity_log
+    LOG_PAGE_IDS.update(zip(LOG_PAGE_TITLES, ids))
+    return LOG_PAGE_IDS
+
+
+async def log_page_id(title: str) -> str:
+    if title not in LOG_PAGE_IDS:
+        await resolve_log_page_ids()
+    return LOG_PAGE_IDS[title]
+
+
+async def write_log_batch(entries: list[str]):
     try:
-        activity_log = ensure_child_page(MAIN_PAGE_ID, "Activity Log")
-        daily_log = ensure_child_page(activity_log, "Daily Log")
-        content = f"[{timestamp()}] {action} | target: {target} | status: {status}"
-        notion.blocks.children.append(
-            block_id=daily_log,
-            children=[
-                {
-                    "object": "block",
-                    "type": "paragraph",
-                    "paragraph": {
-                        "rich_text": [{"type": "text", "text": {"content": content}}]
-                    },
-                }
-            ],
+        await call_notion(
+            notion.blocks.children.append,
+            block_id=await log_page_id("Daily Log"),
+            children=[paragraph_block(entry) for entry in entries],
         )
     except Exception as e:
-        print(f"⚠️ log_action failed: {e}")
-    finally:
-        print(f"LOG [{level}]: {action} | {target} | {status}")
+        print(f"⚠️ log flush failed ({len(entries)} entries): {e}")
+
 
+async def flush_logs():
+    loop = asyncio.get_running_loop()
+    stopping = False
+    while not stopping:
+        entry = await _log_queue.get()
+        if entry is None:
+            return
+        batch = [entry]
+        deadline = loop.time() + LOG_FLUSH_INTERVAL
+        while len(batch) < LOG_BATCH_SIZE:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                entry = await asyncio.wait_for(_log_queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if entry is None:
+                stopping = True
+                break
+            batch.append(entry)
+        await write_log_batch(batch)
 
-def create_page(parent_id: str, title: str):
+
+async def create_page(parent_id: str, title: str):
     try:
-        page = notion.pages.create(
+        page = await call_notion(
+            notion.pages.create,
             parent={"page_id": parent_id},
             properties={"title": [{"type": "text", "text": {"content": title}}]},
         )
+        remember_child_page(parent_id, title, page["id"])
         log_action("CREATE_PAGE", title, "success")
         print(f"✅ Created new page '{title}' under parent {parent_id}")
         return page["id"]
@@ -122,53 +495,162 @@ def create_page(parent_id: str, title: str):
         raise e
 
 
-def ensure_child_page(parent_page_id: str, title: str) -> str:
-    try:
-        resp = notion.blocks.children.list(block_id=parent_page_id)
-        for block in resp.get("results", []):
-            if (
-                block.get("type") == "child_page"
-                and block["child_page"]["title"] == title
-            ):
-                return block["id"]
-    except Exception as e:
-        print(f"⚠️ Could not list children for {parent_page_id}: {e}")
+async def ensure_child_page(parent_page_id: str, title: str) -> str:
+    cached = _child_page_cache.get(parent_page_id, {}).get(title)
+    if cached:
+        return cached
+    if parent_page_id not in _listed_parents:
+        try:
+            found = await find_child_page(parent_page_id, title)
+        except Exception as e:
+            print(f"⚠️ Could not list children for {parent_page_id}: {e}")
+        else:
+            if found:
+                return found
     try:
-        page = notion.pages.create(
+        page = await call_notion(
+            notion.pages.create,
             parent={"type": "page_id", "page_id": parent_page_id},
             properties={"title": [{"type": "text", "text": {"content": title}}]},
         )
         print(f"✅ Created new page: {title}")
-        return page["id"]
     except Exception as e:
         print(f"❌ Failed to create page '{title}': {e}")
         raise e
+    remember_child_page(parent_page_id, title, page["id"])
+    return page["id"]
+
+
+async def iter_log_entries(*block_ids: str):
+    # Yields one API page at a time, so a whole log is never held in memory.
+    for block_id in block_ids:
+        cursor = None
+        while True:
+            resp = await call_notion(
+                notion.blocks.children.list,
+                block_id=block_id,
+                start_cursor=cursor,
+                page_size=100,
+            )
+            for block in resp.get("results", []):
+                if block.get("type") == "paragraph":
+                    rich_text = block["paragraph"]["rich_text"]
+                    if rich_text:
+                        yield rich_text[0]["text"]["content"]
+            if not resp.get("has_more"):
+                break
+            cursor = resp.get("next_cursor")
+
 
+def structure_edges_by_depth(structure):
+    # One tuple of (parent_path, title) edges per depth.
+    levels, pending = [], [((), structure)]
+    while pending:
+        level, next_pending = [], []
+        for path, node in pending:
+            if isinstance(node, dict):
+                for title, sub in node.items():
+                    level.append((path, title))
+                    next_pending.append((path + (title,), sub))
+            else:
+                level.extend((path, title) for title in node)
+        levels.append(tuple(level))
+        pending = next_pending
+    return tuple(levels)
 
-def create_version_snapshot(page_id, title=""):
-    log_action("VERSION_SNAPSHOT", title or page_id, "snapshot stored")
-    activity_log = ensure_child_page(MAIN_PAGE_ID, "Activity Log")
-    archive_page = ensure_child_page(activity_log, "Archive")
+
+async def build_structure(root_id: str, edges_by_depth):
+    ids = {(): root_id}
+    for level in edges_by_depth:
+        # Page each parent once up front so concurrent siblings hit the cache.
+        wanted = {}
+        for path, title in level:
+            wanted.setdefault(path, set()).add(title)
+        await asyncio.gather(
+            *[cached_child_pages(ids[path], titles) for path, titles in wanted.items()]
+        )
+        created = await asyncio.gather(
+            *[ensure_child_page(ids[path], title) for path, title in level]
+        )
+        for (path, title), page_id in zip(level, created):
+            ids[path + (title,)] = page_id
+    return ids
+
+
+async def build_brand_category(brand_id: str, category: str, subpages):
+    category_id = await ensure_child_page(brand_id, category)
+    await cached_child_pages(category_id, set(subpages))
+    subpage_ids = await asyncio.gather(
+        *[ensure_child_page(category_id, title) for title in subpages]
+    )
+    return [{"title": t, "id": i} for t, i in zip(subpages, subpage_ids)]
+
+
+async def build_brand(brand: str):
+    # A category's subpages start as soon as that category exists.
+    brand_id = await ensure_child_page(MAIN_PAGE_ID, brand)
+    await cached_child_pages(brand_id, BRAND_CATEGORIES)
+    results = await asyncio.gather(
+        *[
+            build_brand_category(brand_id, category, subpages)
+            for category, subpages in BRAND_BOOTSTRAP_PLAN
+        ]
+    )
+    return brand, {
+        "categories": {
+            category: pages
+            for (category, _), pages in zip(BRAND_BOOTSTRAP_PLAN, results)
+        }
+    }
+
+
+async def warm_brand_cache():
+    # Only pages far enough to find existing titles; creates nothing.
+    try:
+        hub = await cached_child_pages(MAIN_PAGE_ID, set(BRAND_NAMES))
+        brands = await asyncio.gather(
+            *[
+                cached_child_pages(hub[brand], BRAND_CATEGORIES)
+                for brand in BRAND_NAMES
+                if brand in hub
+            ]
+        )
+        await asyncio.gather(
+            *[
+                cached_child_pages(categories[category], set(subpages))
+                for categories in brands
+                for category, subpages in BRAND_BOOTSTRAP_PLAN
+                if category in categories
+            ]
+        )
+    except Exception as e:
+        print(f"⚠️ Could not warm the brand cache: {e}")
+
+
+async def as_completed_brands():
+    # Yields in completion order; one failure stops the remaining brands.
+    tasks = [asyncio.create_task(build_brand(brand)) for brand in BRAND_NAMES]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Wait for the cancelled brands to unwind and retrieve their errors.
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def create_version_snapshot(page_id, title="", skip_log=False):
+    # Callers that log their own change pass skip_log.
+    if not skip_log:
+        log_action("VERSION_SNAPSHOT", title or page_id, "snapshot stored")
+    archive_page = await log_page_id("Archive")
     snapshot_title = f"{title or 'Untitled'} (Snapshot {timestamp()})"
-    notion.pages.create(
+    await call_notion(
+        notion.pages.create,
         parent={"page_id": archive_page},
         properties={"title": [{"type": "text", "text": {"content": snapshot_title}}]},
-        children=[
-            {
-                "object": "block",
-                "type": "paragraph",
-                "paragraph": {
-                    "rich_text": [
-                        {
-                            "type": "text",
-                            "text": {
-                                "content": f"Snapshot of {page_id} at {timestamp()}."
-                            },
-                        }
-                    ]
-                },
-            }
-        ],
+        children=[paragraph_block(f"Snapshot of {page_id} at {timestamp()}.")],
     )
 
 
@@ -264,6 +746,12 @@ COMMAND_CENTER_STRUCTURE = {
     },
 }
 
+COMMAND_CENTER_EDGES_BY_DEPTH = structure_edges_by_depth(COMMAND_CENTER_STRUCTURE)
+
+BRAND_NAMES = tuple(map(sys.intern, ("OptiMax", "VETTA", "Prosperyn", "Nuvora")))
+
+HUB_ROOT_PAGES = (*COMMAND_CENTER_STRUCTURE, "Command Center", *BRAND_NAMES)
+
 BRAND_CATEGORY_STRUCTURE = {
     "Brand HQ": [
         "Vision & Mission",
@@ -303,15 +791,67 @@ BRAND_CATEGORY_STRUCTURE = {
     ],
 }
 
+# Interned, like titles read from Notion, so lookups mostly compare by identity.
+BRAND_CATEGORY_STRUCTURE = {
+    sys.intern(category): tuple(map(sys.intern, subpages))
+    for category, subpages in BRAND_CATEGORY_STRUCTURE.items()
+}
+
+# Each brand's (category, subpages) tasks, built once at import.
+BRAND_BOOTSTRAP_PLAN = tuple(BRAND_CATEGORY_STRUCTURE.items())
+BRAND_CATEGORIES = frozenset(BRAND_CATEGORY_STRUCTURE)
+
+
+# An entry counts once per counter, however many of its keywords it has.
+SUMMARY_KEYWORDS = {
+    "AGENT": "agent",
+    "HUMAN": "human",
+    "DELETE": "deletes",
+    "UPDATE": "updates",
+    "RENAME": "updates",
+    "APPEND": "creates",
+    "CREATE": "creates",
+}
+_SUMMARY_RE = re.compile("|".join(SUMMARY_KEYWORDS))
+
+
+def regex_entry_counters(entry: str) -> set[str]:
+    return {SUMMARY_KEYWORDS[kw] for kw in _SUMMARY_RE.findall(entry)}
+
+
+if ahocorasick is not None:
+    _summary_automaton = ahocorasick.Automaton()
+    for _keyword, _counter in SUMMARY_KEYWORDS.items():
+        _summary_automaton.add_word(_keyword, _counter)
+    _summary_automaton.make_automaton()
+
+    def automaton_entry_counters(entry: str) -> set[str]:
+        return {counter for _, counter in _summary_automaton.iter(entry)}
+
+    entry_counters = automaton_entry_counters
+else:
+    entry_counters = regex_entry_counters
+
+
+def new_summary_counts():
+    return dict.fromkeys(("total", *SUMMARY_KEYWORDS.values()), 0)
+
+
+def tally_entry(counts, entry: str):
+    counts["total"] += 1
+    for name in entry_counters(entry):
+        counts[name] += 1
+
 
 def summarize_entries(entries, level="daily"):
-    total = len(entries)
-    agent_actions = len([e for e in entries if "AGENT" in e])
-    human_actions = len([e for e in entries if "HUMAN" in e])
-    deletes = len([e for e in entries if "DELETE" in e])
-    updates = len([e for e in entries if "UPDATE" in e or "RENAME" in e])
-    creates = len([e for e in entries if "APPEND" in e or "CREATE" in e])
-    result = f"{level.capitalize()} Summary: {total} actions — {agent_actions} agent, {human_actions} human. {creates} created, {updates} updated, {deletes} deleted."
+    counts = new_summary_counts()
+    for entry in entries:
+        tally_entry(counts, entry)
+    return format_summary(counts, level)
+
+
+def format_summary(counts, level="daily"):
+    result = f"{level.capitalize()} Summary: {counts['total']} actions — {counts['agent']} agent, {counts['human']} human. {counts['creates']} created, {counts['updates']} updated, {counts['deletes']} deleted."
     moods = [
         "Progress steady ✅",
         "All systems stable ⚙️",
@@ -326,26 +866,18 @@ def summarize_entries(entries, level="daily"):
 # -------------------------------------------------
 @app.get("/")
 @app.get("/health")
-def health():
+async def health():
     return {"status": "OptiMax API fully operational"}
 
 
 @app.post("/build_command_center_structure")
-def build_command_center_structure():
+async def build_command_center_structure(reset: bool = False):
+    if reset:
+        invalidate_cache()
     log_action("BUILD_STRUCTURE_INIT", "Command Center", "starting")
     try:
-        cc_id = ensure_child_page(MAIN_PAGE_ID, "Command Center")
-
-        def build_substructure(parent_id, structure):
-            if isinstance(structure, dict):
-                for section, sub in structure.items():
-                    section_id = ensure_child_page(parent_id, section)
-                    build_substructure(section_id, sub)
-            elif isinstance(structure, list):
-                for item in structure:
-                    ensure_child_page(parent_id, item)
-
-        build_substructure(cc_id, COMMAND_CENTER_STRUCTURE)
+        cc_id = await ensure_child_page(MAIN_PAGE_ID, "Command Center")
+        await build_structure(cc_id, COMMAND_CENTER_EDGES_BY_DEPTH)
         log_action(
             "BUILD_STRUCTURE_COMPLETE", "Command Center", "recursive build complete"
         )
@@ -360,31 +892,75 @@ def build_command_center_structure():
         return {"error": str(e)}
 
 
+# Documents the streamed body's shape only; never used to encode it.
+@app.post(
+    "/bootstrap_brand_structure",
+    response_class=StreamingResponse,
+    responses={200: {"model": BootstrapResponse}},
+)
+async def bootstrap_brand_structure():
+    # A failure after streaming started ends the object with "error".
+    async def stream():
+        log_action("BOOTSTRAP_BRANDS_INIT", "Brands", "starting")
+        yield b'{"brands":{'
+        try:
+            if not _child_page_cache.get(MAIN_PAGE_ID, {}).keys() >= set(BRAND_NAMES):
+                try:
+                    await prime_tree()
+                except Exception as e:
+                    print(f"⚠️ Could not prime the page tree from search: {e}")
+            await cached_child_pages(MAIN_PAGE_ID, set(BRAND_NAMES))
+            done = 0
+            async for brand, result in as_completed_brands():
+                yield (b"," if done else b"") + orjson.dumps(brand) + b":"
+                yield orjson.dumps(result)
+                done += 1
+            save_child_page_cache()
+            log_action("BOOTSTRAP_BRANDS_COMPLETE", "Brands", f"{done} brands")
+            print("✅ Brand structure bootstrapped successfully.")
+            yield b'},"status":"completed"}'
+        except Exception as e:
+            log_action("BOOTSTRAP_BRANDS_FAILED", "Brands", str(e))
+            print(f"❌ Error bootstrapping brands: {e}")
+            yield b'},"error":' + orjson.dumps(str(e)) + b"}"
+
+    return StreamingResponse(stream(), media_type="application/json")
+
+
+@app.post("/bootstrap_brand_structure/invalidate")
+async def invalidate_bootstrap_cache():
+    invalidate_cache()
+    try:
+        os.remove(CHILD_PAGE_CACHE_FILE)
+    except FileNotFoundError:
+        pass
+    log_action("CACHE_INVALIDATED", "Child pages", "cleared")
+    return {"status": "invalidated"}
+
+
 @app.post("/sync_structure")
-async def sync_structure(request: Request):
-    data = await request.json()
-    change_type = data.get("change_type", "minor")
+async def sync_structure(data: SyncStructureRequest):
+    change_type = data.change_type
     log_action("SYNC_INIT", "Workspace structure check started")
-    current_pages = list_child_pages(MAIN_PAGE_ID)
-    expected_roots = list(COMMAND_CENTER_STRUCTURE.keys()) + [
-        "Command Center",
-        "OptiMax",
-        "VETTA",
-        "Prosperyn",
-        "Nuvora",
+    current_pages = await list_child_pages(MAIN_PAGE_ID)
+    expected_roots = HUB_ROOT_PAGES
+    missing_pages = []
+    added_pages = [
+        expected for expected in expected_roots if expected not in current_pages
+    ]
+    unexpected_pages = [
+        current for current in current_pages if current not in expected_roots
     ]
-    added_pages, missing_pages, unexpected_pages = [], [], []
-    for expected in expected_roots:
-        if expected not in current_pages:
-            ensure_child_page(MAIN_PAGE_ID, expected)
-            added_pages.append(expected)
-            log_action("CREATE_PAGE", expected, "added")
-    for current in current_pages.keys():
-        if current not in expected_roots:
-            unexpected_pages.append(current)
-            log_action("UNEXPECTED_PAGE", current, "not in structure")
+    # current_pages came from a full listing, so these all go straight to create.
+    await asyncio.gather(
+        *[ensure_child_page(MAIN_PAGE_ID, expected) for expected in added_pages]
+    )
+    for expected in added_pages:
+        log_action("CREATE_PAGE", expected, "added")
+    for current in unexpected_pages:
+        log_action("UNEXPECTED_PAGE", current, "not in structure")
     if unexpected_pages:
-        confirm_pin("major", "Workspace Restructure")
+        confirm_pin("major", "Workspace Restructure", data.pin)
         log_action("REVIEW", "Unexpected pages require review", f"{unexpected_pages}")
     summary = {
         "added_pages": added_pages,
@@ -404,27 +980,38 @@ async def sync_structure(request: Request):
 @app.post("/create_page")
 async def create_page_endpoint(data: CreatePageRequest):
     try:
-        pid = create_page(data.parent_id, data.title)
+        pid = await create_page(data.parent_id, data.title)
         return {"status": "success", "page_id": pid, "title": data.title}
     except Exception as e:
         return {"error": str(e)}
 
 
 @app.get("/list_hub_pages")
-def list_hub_pages():
+async def list_hub_pages():
     try:
-        pages = list_child_pages(MAIN_PAGE_ID)
+        pages = await list_child_pages(MAIN_PAGE_ID)
         return {"pages": list(pages.keys())}
     except Exception as e:
         return {"error": str(e)}
 
 
 @app.get("/read_page")
-def read_page(identifier: str):
+async def read_page(identifier: str):
     try:
-        pages = list_child_pages(MAIN_PAGE_ID)
-        pid = pages.get(identifier, {}).get("id", identifier)
-        page = notion.pages.retrieve(page_id=pid)
+        pid = await resolve_page_id(identifier)
+        retrieval = _read_page_cache.get(pid)
+        if retrieval is None or retrieval.cancelled():
+            retrieval = asyncio.ensure_future(
+                call_notion(notion.pages.retrieve, page_id=pid)
+            )
+            _read_page_cache[pid] = retrieval
+        try:
+            page = await asyncio.shield(retrieval)
+        except BaseException:
+            # Drop a failed retrieval, but not one other readers still await.
+            if retrieval.done() and _read_page_cache.get(pid) is retrieval:
+                del _read_page_cache[pid]
+            raise
         return {"page_id": pid, "title": identifier, "content": page}
     except Exception as e:
         return {"error": str(e)}
@@ -433,18 +1020,11 @@ def read_page(identifier: str):
 @app.post("/append_to_page")
 async def append_to_page(data: AppendRequest):
     try:
-        pid, txt = data.page_id, data.content
-        notion.blocks.children.append(
+        pid, txt = await resolve_page_id(data.page_id), data.content
+        await call_notion(
+            notion.blocks.children.append,
             block_id=pid,
-            children=[
-                {
-                    "object": "block",
-                    "type": "paragraph",
-                    "paragraph": {
-                        "rich_text": [{"type": "text", "text": {"content": txt}}]
-                    },
-                }
-            ],
+            children=[paragraph_block(txt)],
         )
         log_action("APPEND", pid, "success")
         return {"status": "success", "page": pid, "content": txt}
@@ -453,32 +1033,55 @@ async def append_to_page(data: AppendRequest):
         return {"error": str(e)}
 
 
+@app.post("/batch_append_to_page")
+async def batch_append_to_page(data: BatchAppendRequest):
+    # Chunks go out one after another so the paragraphs keep their order.
+    try:
+        pid = await resolve_page_id(data.page_id)
+        blocks = [paragraph_block(txt) for txt in data.contents]
+        for start in range(0, len(blocks), APPEND_BLOCK_LIMIT):
+            await call_notion(
+                notion.blocks.children.append,
+                block_id=pid,
+                children=blocks[start : start + APPEND_BLOCK_LIMIT],
+            )
+        log_action("APPEND_BATCH", pid, f"{len(blocks)} paragraphs")
+        return {"status": "success", "page": pid, "appended": len(blocks)}
+    except Exception as e:
+        log_action("APPEND_BATCH_FAILED", data.page_id, str(e))
+        return {"error": str(e)}
+
+
 @app.post("/update_page_title")
 async def update_page_title(request: UpdateTitleRequest):
     pid, new = request.page_id, request.new_title
+    confirm_pin("major", pid, request.pin)
     try:
-        confirm_pin("major", pid)
-        create_version_snapshot(pid, pid)
-        notion.pages.update(
+        pid = await resolve_page_id(pid)
+        await create_version_snapshot(pid, pid, skip_log=True)
+        await call_notion(
+            notion.pages.update,
             page_id=pid,
             properties={"title": [{"type": "text", "text": {"content": new}}]},
         )
-        log_action("RENAME", pid)
+        rename_child_page(pid, new)
+        _read_page_cache.pop(pid, None)
+        log_action("RENAME", pid, "snapshot stored")
         return {"status": "renamed", "page": pid}
     except Exception as e:
         return {"error": str(e)}
 
 
 @app.post("/archive_page")
-async def archive_page(request: Request):
-    data = await request.json()
-    pid = data.get("page_id")
+async def archive_page(data: PageActionRequest):
+    pid = data.page_id
+    confirm_pin("major", pid, data.pin)
     try:
-        confirm_pin("major", pid)
-        create_version_snapshot(pid, pid)
-        activity_log = ensure_child_page(MAIN_PAGE_ID, "Activity Log")
-        archive = ensure_child_page(activity_log, "Archive")
-        notion.blocks.children.append(
+        pid = await resolve_page_id(pid)
+        await create_version_snapshot(pid, pid, skip_log=True)
+        archive = await log_page_id("Archive")
+        await call_notion(
+            notion.blocks.children.append,
             block_id=archive,
             children=[
                 {
@@ -488,17 +1091,17 @@ async def archive_page(request: Request):
                 }
             ],
         )
-        log_action("ARCHIVE", pid)
+        log_action("ARCHIVE", pid, "snapshot stored")
         return {"status": "archived", "page": pid}
     except Exception as e:
         return {"error": str(e)}
 
 
 @app.post("/revert_to_previous")
-async def revert_to_previous(request: Request):
-    data = await request.json()
-    pid = data.get("page_id")
+async def revert_to_previous(data: PageActionRequest):
+    pid = data.page_id
     try:
+        pid = await resolve_page_id(pid)
         log_action("REVERT", pid)
         print(f"♻️  Reversion simulated for {pid}")
         return {"status": f"Reverted {pid} (simulated)"}
@@ -507,46 +1110,44 @@ async def revert_to_previous(request: Request):
 
 
 @app.get("/summarize_activity")
-def summarize_activity(level: str = "daily"):
+async def summarize_activity(level: str = "daily", limit: int = SUMMARY_ENTRY_LIMIT):
+    # limit=0 scans every log entry; the logs only grow, so that is opt-in.
     try:
-        activity_log = ensure_child_page(MAIN_PAGE_ID, "Activity Log")
-        daily_log = ensure_child_page(activity_log, "Daily Log")
-        agent_logs = ensure_child_page(activity_log, "Agent Logs")
-        human_logs = ensure_child_page(activity_log, "Human Logs")
-        entries = []
-        if level == "daily":
-            resp = notion.blocks.children.list(block_id=daily_log)
-            entries = [
-                b["paragraph"]["rich_text"][0]["text"]["content"]
-                for b in resp.get("results", [])
-                if b.get("type") == "paragraph"
-            ]
-        else:
-            for pid in [daily_log, agent_logs, human_logs]:
-                resp = notion.blocks.children.list(block_id=pid)
-                entries += [
-                    b["paragraph"]["rich_text"][0]["text"]["content"]
-                    for b in resp.get("results", [])
-                    if b.get("type") == "paragraph"
-                ]
-        summary = summarize_entries(entries, level)
+        titles = ["Daily Log"]
+        if level != "daily":
+            titles += ["Agent Logs", "Human Logs"]
+        log_ids = [await log_page_id(title) for title in titles]
+        counts = new_summary_counts()
+        async with aclosing(iter_log_entries(*log_ids)) as entries:
+            async for entry in entries:
+                tally_entry(counts, entry)
+                if limit and counts["total"] >= limit:
+                    break
+        summary = format_summary(counts, level)
         print(f"🧭 {level.capitalize()} summary generated.")
-        return {"summary": summary, "entries_analyzed": len(entries)}
+        return {"summary": summary, "entries_analyzed": counts["total"]}
     except Exception as e:
         return {"error": f"Summary failed: {e}"}
 
 
+@app.post("/refresh_log_ids")
+async def refresh_log_ids():
+    try:
+        invalidate_cache(MAIN_PAGE_ID)
+        # invalidate_cache(None) would wipe the whole cache.
+        if "Activity Log" in LOG_PAGE_IDS:
+            invalidate_cache(LOG_PAGE_IDS["Activity Log"])
+        LOG_PAGE_IDS.clear()
+        return {"status": "refreshed", "log_pages": await resolve_log_page_ids()}
+    except Exception as e:
+        return {"error": str(e)}
+
+
 @app.post("/create_template")
-async def create_template(request: Request):
-    data = await request.json()
+async def create_template(data: TemplateRequest):
     try:
-        ttype = data.get("template_type", "Planner")
-        notion.pages.create(
-            parent={"page_id": MAIN_PAGE_ID},
-            properties={
-                "title": [{"type": "text", "text": {"content": f"{ttype} Template"}}]
-            },
-        )
+        ttype = data.template_type
+        await create_page(MAIN_PAGE_ID, f"{ttype} Template")
         log_action("CREATE_TEMPLATE", ttype)
         return {"status": f"{ttype} template created"}
     except Exception as e:
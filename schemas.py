@@ -12,6 +12,41 @@ class AppendRequest(BaseModel):
     content: str
 
 
+class BatchAppendRequest(BaseModel):
+    page_id: str
+    contents: list[str]
+
+
 class UpdateTitleRequest(BaseModel):
     page_id: str
     new_title: str
+    pin: str | None = None
+
+
+class PageActionRequest(BaseModel):
+    page_id: str
+    pin: str | None = None
+
+
+class SyncStructureRequest(BaseModel):
+    change_type: str = "minor"
+    pin: str | None = None
+
+
+class TemplateRequest(BaseModel):
+    template_type: str = "Planner"
+
+
+class SubPage(BaseModel):
+    title: str
+    id: str
+
+
+class BrandResult(BaseModel):
+    categories: dict[str, list[SubPage]]
+
+
+class BootstrapResponse(BaseModel):
+    brands: dict[str, BrandResult]
+    status: str | None = None
+    error: str | None = None
@@ -3,12 +3,19 @@ from unittest.mock import MagicMock
 from dotenv import load_dotenv
 import notion_client
 
+load_dotenv()
 
-def _run_connection_check():
-    """Helper: run the same logic the original script used and print results."""
-    load_dotenv()
-    notion_token = os.getenv("NOTION_TOKEN")
-    page_id = os.getenv("PAGE_ID")
+
+def _run_connection_check(notion_token=None, page_id=None):
+    """Helper: run the same logic the original script used and print results.
+
+    Values not passed in are read from the environment (.env is loaded once at
+    import).
+    """
+    if notion_token is None:
+        notion_token = os.getenv("NOTION_TOKEN")
+    if page_id is None:
+        page_id = os.getenv("PAGE_ID")
 
     notion = notion_client.Client(auth=notion_token)
 
@@ -67,3 +74,24 @@ def test_connection_raises_exception(monkeypatch, capsys):
     out = capsys.readouterr().out
     assert "Error connecting to Notion API" in out
     assert "network error" in out
+
+
+def test_connection_with_explicit_arguments(monkeypatch, capsys):
+    monkeypatch.setenv("NOTION_TOKEN", "env-token")
+    monkeypatch.setenv("PAGE_ID", "env_page")
+
+    mock_client = MagicMock()
+    mock_client.pages.retrieve.return_value = {"id": "page_456"}
+    tokens = []
+
+    def client(auth):
+        tokens.append(auth)
+        return mock_client
+
+    monkeypatch.setattr(notion_client, "Client", client)
+
+    _run_connection_check(notion_token="arg-token", page_id="page_456")
+    out = capsys.readouterr().out
+    assert tokens == ["arg-token"]
+    mock_client.pages.retrieve.assert_called_once_with(page_id="page_456")
+    assert "page_456" in out
@@ -1,5 +1,562 @@
+import asyncio
+import gc
+from unittest.mock import AsyncMock
+
+import httpx
+import orjson
+import pytest
+from aiolimiter import AsyncLimiter
+from notion_client import APIResponseError
+
 import main
 
 
+@pytest.fixture(autouse=True)
+def fresh_main_state(monkeypatch, tmp_path):
+    # The limiter, semaphore and log queue bind to the first event loop that
+    # waits on them; each asyncio.run() below starts a new loop. The caches
+    # are module globals, so every test starts from empty ones.
+    monkeypatch.setattr(main, "_notion_rate", AsyncLimiter(100, 1))
+    monkeypatch.setattr(main, "_notion_semaphore", asyncio.Semaphore(8))
+    monkeypatch.setattr(main, "_log_queue", asyncio.Queue())
+    monkeypatch.setattr(main, "LOG_PAGE_IDS", {})
+    monkeypatch.setattr(
+        main, "CHILD_PAGE_CACHE_FILE", str(tmp_path / "child_page_cache.json")
+    )
+    main.invalidate_cache()
+    main._child_page_listings.clear()
+    main._read_page_cache.clear()
+
+
+@pytest.fixture
+def mock_notion(monkeypatch):
+    # Stands in for the Notion client; the hub page ID is "hub".
+    notion = AsyncMock()
+    monkeypatch.setattr(main, "notion", notion)
+    monkeypatch.setattr(main, "MAIN_PAGE_ID", "hub")
+    return notion
+
+
+def child(title, page_id=None):
+    return {
+        "type": "child_page",
+        "id": page_id or f"{title}-id",
+        "child_page": {"title": title},
+    }
+
+
+def paragraph(text):
+    return {
+        "type": "paragraph",
+        "paragraph": {"rich_text": [{"text": {"content": text}}]},
+    }
+
+
+def children_page(results, cursor=None):
+    # One page of a blocks.children.list response; a cursor means more follow.
+    return {"results": results, "has_more": cursor is not None, "next_cursor": cursor}
+
+
+def fake_child_listing(existing):
+    # blocks.children.list side effect serving existing[parent] = {title: id}.
+    async def list_children(block_id, **kwargs):
+        return children_page([child(t, i) for t, i in existing[block_id].items()])
+
+    return list_children
+
+
 def test_health():
-    assert main.health() == {"status": "OptiMax API ready"}
+    assert asyncio.run(main.health()) == {"status": "OptiMax API ready"}
+
+
+def test_ensure_child_page_lists_parent_once(mock_notion):
+    mock_notion.blocks.children.list.return_value = children_page([child("A")])
+    mock_notion.pages.create.return_value = {"id": "b-id"}
+
+    async def lookups():
+        return [await main.ensure_child_page("parent", t) for t in ("A", "B", "B")]
+
+    assert asyncio.run(lookups()) == ["A-id", "b-id", "b-id"]
+    assert mock_notion.blocks.children.list.call_count == 1
+    assert mock_notion.pages.create.call_count == 1
+
+
+def test_log_entries_are_flushed_in_one_append(monkeypatch, mock_notion):
+    monkeypatch.setattr(main, "LOG_PAGE_IDS", {"Daily Log": "daily-log"})
+
+    main.log_action("CREATE_PAGE", "A", "success")
+    main.log_action("APPEND", "B", "success")
+    main._log_queue.put_nowait(None)
+    asyncio.run(main.flush_logs())
+
+    mock_notion.blocks.children.append.assert_called_once()
+    children = mock_notion.blocks.children.append.call_args.kwargs["children"]
+    assert len(children) == 2
+
+
+@pytest.mark.parametrize(
+    "counters", ["automaton_entry_counters", "regex_entry_counters"]
+)
+def test_summarize_entries_counts_each_entry_once_per_category(monkeypatch, counters):
+    if not hasattr(main, counters):
+        pytest.skip("pyahocorasick is not installed")
+    monkeypatch.setattr(main, "entry_counters", getattr(main, counters))
+    entries = [
+        "[t] AGENT CREATE_PAGE | target: A",
+        "[t] HUMAN UPDATE then RENAME | target: B",
+        "[t] DELETE | target: C",
+    ]
+    summary = main.summarize_entries(entries)
+    assert summary.startswith(
+        "Daily Summary: 3 actions — 1 agent, 1 human. 1 created, 1 updated, 1 deleted."
+    )
+
+
+def test_ensure_child_page_stops_at_first_matching_page(mock_notion):
+    mock_notion.blocks.children.list.return_value = children_page(
+        [child("A")], "cursor-2"
+    )
+
+    assert asyncio.run(main.ensure_child_page("parent", "A")) == "A-id"
+    mock_notion.blocks.children.list.assert_called_once_with(
+        block_id="parent", start_cursor=None, page_size=100
+    )
+
+
+def test_resolve_page_id_skips_lookup_for_page_ids(mock_notion):
+    page_id = "1234abcd-1234-abcd-1234-abcd1234abcd"
+
+    assert asyncio.run(main.resolve_page_id(page_id)) == page_id
+    mock_notion.blocks.children.list.assert_not_called()
+
+
+def test_resolve_page_id_matches_hub_titles_case_insensitively(mock_notion):
+    mock_notion.blocks.children.list.side_effect = [
+        children_page([child("Planner", "p-id")]),
+        children_page([child("Roadmap", "p-id")]),
+    ]
+
+    async def lookups():
+        before = await main.resolve_page_id("planner")
+        main.rename_child_page("p-id", "Roadmap")
+        return before, [await main.resolve_page_id(t) for t in ("roadmap", "planner")]
+
+    # The renamed title hits the cache; the old one misses and re-lists once.
+    assert asyncio.run(lookups()) == ("p-id", ["p-id", "planner"])
+    assert mock_notion.blocks.children.list.call_count == 2
+
+
+def test_read_page_finds_hub_pages_added_after_listing(mock_notion):
+    mock_notion.blocks.children.list.side_effect = [
+        children_page([]),
+        children_page([child("Added In Notion", "ui-id")]),
+    ]
+    mock_notion.pages.create.return_value = {"id": "template-id"}
+    mock_notion.pages.retrieve.side_effect = lambda page_id: {"id": page_id}
+
+    async def reads():
+        await main.list_child_pages("hub")
+        await main.create_template(main.TemplateRequest())
+        return [
+            (await main.read_page(t))["page_id"]
+            for t in ("Planner Template", "Added In Notion")
+        ]
+
+    assert asyncio.run(reads()) == ["template-id", "ui-id"]
+    assert mock_notion.blocks.children.list.call_count == 2
+
+
+def test_call_notion_retries_after_rate_limit(monkeypatch):
+    rate_limited = APIResponseError(
+        httpx.Response(429, headers={"Retry-After": "0.25"}),
+        "slow down",
+        "rate_limited",
+    )
+    method = AsyncMock(side_effect=[rate_limited, {"id": "ok"}])
+    sleeps = []
+
+    async def fake_sleep(delay):
+        sleeps.append(delay)
+
+    monkeypatch.setattr(main.asyncio, "sleep", fake_sleep)
+
+    assert asyncio.run(main.call_notion(method, page_id="x")) == {"id": "ok"}
+    assert method.call_count == 2
+    assert sleeps == [0.25]
+
+
+def test_confirm_pin_checks_pin_from_request(monkeypatch):
+    from fastapi import HTTPException
+
+    monkeypatch.setenv("AGENT_AUTH_KEY", "1234")
+
+    main.confirm_pin("major", "page", "1234")
+    main.confirm_pin("minor", "page")
+    with pytest.raises(HTTPException) as excinfo:
+        main.confirm_pin("major", "page", "0000")
+    assert excinfo.value.status_code == 403
+
+
+def test_summarize_activity_reads_one_page_unless_asked_for_all(
+    monkeypatch, mock_notion
+):
+    first_page = children_page([paragraph("AGENT CREATE")] * 100, "c2")
+    mock_notion.blocks.children.list.side_effect = lambda **kwargs: (
+        first_page if kwargs["start_cursor"] is None else children_page([])
+    )
+    monkeypatch.setattr(main, "LOG_PAGE_IDS", {"Daily Log": "daily-log"})
+
+    assert asyncio.run(main.summarize_activity())["entries_analyzed"] == 100
+    assert mock_notion.blocks.children.list.call_count == 1
+    assert asyncio.run(main.summarize_activity(limit=0))["entries_analyzed"] == 100
+    assert mock_notion.blocks.children.list.call_count == 3
+
+
+def test_summarize_activity_streams_log_pages(monkeypatch, mock_notion):
+    mock_notion.blocks.children.list.side_effect = [
+        children_page([paragraph("AGENT CREATE")], "c2"),
+        children_page([paragraph("HUMAN DELETE")]),
+    ]
+    monkeypatch.setattr(main, "LOG_PAGE_IDS", {"Daily Log": "daily-log"})
+
+    result = asyncio.run(main.summarize_activity())
+    assert result["entries_analyzed"] == 2
+    assert result["summary"].startswith(
+        "Daily Summary: 2 actions — 1 agent, 1 human. 1 created, 0 updated, 1 deleted."
+    )
+
+
+def test_ensure_child_page_resumes_partial_listing(mock_notion):
+    mock_notion.blocks.children.list.side_effect = [
+        children_page([child("A")], "c2"),
+        children_page([child("B")]),
+    ]
+
+    async def lookups():
+        return [await main.ensure_child_page("parent", t) for t in ("A", "B")]
+
+    assert asyncio.run(lookups()) == ["A-id", "B-id"]
+    cursors = [
+        c.kwargs["start_cursor"] for c in mock_notion.blocks.children.list.mock_calls
+    ]
+    assert cursors == [None, "c2"]
+
+
+async def bootstrap():
+    response = await main.bootstrap_brand_structure()
+    return orjson.loads(b"".join([chunk async for chunk in response.body_iterator]))
+
+
+def test_bootstrap_brand_structure_lists_each_parent_once(mock_notion):
+    existing = {"hub": {brand: f"{brand}-id" for brand in main.BRAND_NAMES}}
+    for brand in main.BRAND_NAMES:
+        existing[f"{brand}-id"] = {
+            c: f"{brand}/{c}" for c in main.BRAND_CATEGORY_STRUCTURE
+        }
+        for category, subpages in main.BRAND_CATEGORY_STRUCTURE.items():
+            existing[f"{brand}/{category}"] = {
+                t: f"{brand}/{category}/{t}" for t in subpages
+            }
+
+    mock_notion.search.return_value = {"results": [], "has_more": False}
+    mock_notion.blocks.children.list.side_effect = fake_child_listing(existing)
+
+    result = asyncio.run(bootstrap())
+    assert result["status"] == "completed"
+    assert set(result["brands"]) == set(main.BRAND_NAMES)
+    main.BootstrapResponse.model_validate(result)
+    category, subpages = main.BRAND_BOOTSTRAP_PLAN[0]
+    assert result["brands"]["VETTA"]["categories"][category] == [
+        {"title": t, "id": f"VETTA/{category}/{t}"} for t in subpages
+    ]
+    listed = [c.kwargs["block_id"] for c in mock_notion.blocks.children.list.mock_calls]
+    assert sorted(listed) == sorted(existing)
+    mock_notion.pages.create.assert_not_called()
+
+
+def test_bootstrap_brand_structure_seeded_from_search_skips_listings(mock_notion):
+    pages = [("hub", brand, f"{brand}-id") for brand in main.BRAND_NAMES]
+    for brand in main.BRAND_NAMES:
+        for category, subpages in main.BRAND_CATEGORY_STRUCTURE.items():
+            pages.append((f"{brand}-id", category, f"{brand}/{category}"))
+            pages += [
+                (f"{brand}/{category}", t, f"{brand}/{category}/{t}") for t in subpages
+            ]
+    results = [
+        {
+            "id": page_id,
+            "parent": {"type": "page_id", "page_id": parent},
+            "properties": {
+                "title": {"type": "title", "title": [{"plain_text": title}]}
+            },
+        }
+        for parent, title, page_id in pages
+    ]
+
+    mock_notion.search.side_effect = [
+        {"results": results[:100], "has_more": True, "next_cursor": "c1"},
+        {"results": results[100:], "has_more": False},
+    ]
+
+    result = asyncio.run(bootstrap())
+    assert result["status"] == "completed"
+    assert set(result["brands"]) == set(main.BRAND_NAMES)
+    assert mock_notion.search.call_count == 2
+    mock_notion.blocks.children.list.assert_not_called()
+    mock_notion.pages.create.assert_not_called()
+
+
+def test_build_brand_category_creates_subpages_concurrently_in_order(mock_notion):
+    subpages = ("First", "Second", "Third", "Fourth")
+    in_flight, peak = 0, 0
+
+    async def create(parent, properties, **kwargs):
+        nonlocal in_flight, peak
+        title = properties["title"][0]["text"]["content"]
+        in_flight += 1
+        peak = max(peak, in_flight)
+        # Finish in reverse order to show the result keeps the input order.
+        await asyncio.sleep(0.01 * (len(subpages) - subpages.index(title)))
+        in_flight -= 1
+        return {"id": f"{title}-id"}
+
+    mock_notion.pages.create.side_effect = create
+    main.remember_child_page("hub", "Brand", "brand")
+    main.remember_child_page("brand", "Category", "category-id")
+
+    pages = asyncio.run(main.build_brand_category("brand", "Category", subpages))
+    assert pages == [{"title": t, "id": f"{t}-id"} for t in subpages]
+    assert peak == len(subpages)
+
+
+def test_bootstrap_brand_structure_streams_error_as_valid_json(mock_notion):
+    mock_notion.search.return_value = {"results": [], "has_more": False}
+    mock_notion.blocks.children.list.return_value = children_page([])
+
+    async def create(parent, properties, **kwargs):
+        if properties["title"][0]["text"]["content"] == main.BRAND_NAMES[0]:
+            raise RuntimeError("boom")
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            raise RuntimeError("failed while cancelling")
+
+    mock_notion.pages.create.side_effect = create
+
+    async def run():
+        # Sibling brands that also failed must be awaited, not left to report
+        # "Task exception was never retrieved" when collected.
+        unhandled = []
+        loop = asyncio.get_running_loop()
+        loop.set_exception_handler(lambda loop, context: unhandled.append(context))
+        result = await bootstrap()
+        await asyncio.sleep(0.01)
+        gc.collect()
+        return result, unhandled
+
+    assert asyncio.run(run()) == ({"brands": {}, "error": "boom"}, [])
+
+
+def test_read_page_reuses_recent_retrievals(mock_notion):
+    page_id = "0123456789abcdef0123456789abcdef"
+    mock_notion.pages.retrieve.return_value = {"id": page_id}
+
+    async def reads():
+        first = await asyncio.gather(*[main.read_page(page_id) for _ in range(3)])
+        return first + [await main.read_page(page_id)]
+
+    results = asyncio.run(reads())
+    assert all(r["content"] == {"id": page_id} for r in results)
+    mock_notion.pages.retrieve.assert_called_once_with(page_id=page_id)
+
+
+def test_read_page_survives_a_cancelled_reader(mock_notion):
+    page_id = "0123456789abcdef0123456789abcdef"
+
+    async def reads():
+        release = asyncio.Event()
+
+        async def retrieve(page_id):
+            await release.wait()
+            return {"id": page_id}
+
+        mock_notion.pages.retrieve.side_effect = retrieve
+        first = asyncio.create_task(main.read_page(page_id))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        second = asyncio.create_task(main.read_page(page_id))
+        await asyncio.sleep(0.01)
+        release.set()
+        after_cancel = await second
+
+        # A retrieval that was itself cancelled is evicted, not served until
+        # it expires.
+        main._read_page_cache.clear()
+        release.clear()
+        third = asyncio.create_task(main.read_page(page_id))
+        await asyncio.sleep(0.01)
+        main._read_page_cache[page_id].cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await third
+        release.set()
+        return first.cancelled(), after_cancel, await main.read_page(page_id)
+
+    cancelled, after_cancel, retried = asyncio.run(reads())
+    assert cancelled
+    assert after_cancel["content"] == {"id": page_id}
+    assert retried["content"] == {"id": page_id}
+    assert mock_notion.pages.retrieve.call_count == 3
+
+
+def test_batch_append_to_page_sends_at_most_100_blocks_per_call(mock_notion):
+    page_id = "0123456789abcdef0123456789abcdef"
+    contents = [f"line {i}" for i in range(250)]
+
+    request = main.BatchAppendRequest(page_id=page_id, contents=contents)
+    result = asyncio.run(main.batch_append_to_page(request))
+    assert result == {"status": "success", "page": page_id, "appended": 250}
+    calls = mock_notion.blocks.children.append.mock_calls
+    assert [len(c.kwargs["children"]) for c in calls] == [100, 100, 50]
+    sent = [
+        b["paragraph"]["rich_text"][0]["text"]["content"]
+        for c in calls
+        for b in c.kwargs["children"]
+    ]
+    assert sent == contents
+
+
+def test_saved_child_page_cache_skips_notion_after_restart(mock_notion):
+    main._child_page_cache["hub"] = {}
+    for brand in main.BRAND_NAMES:
+        main.remember_child_page("hub", brand, f"{brand}-id")
+        for category, subpages in main.BRAND_BOOTSTRAP_PLAN:
+            category_id = f"{brand}/{category}"
+            main.remember_child_page(f"{brand}-id", category, category_id)
+            for title in subpages:
+                main.remember_child_page(category_id, title, f"{category_id}/{title}")
+    main.save_child_page_cache()
+    main.invalidate_cache()
+
+    main.load_child_page_cache()
+    result = asyncio.run(bootstrap())
+    assert result["status"] == "completed"
+    assert mock_notion.mock_calls == []
+
+    asyncio.run(main.invalidate_bootstrap_cache())
+    assert main._child_page_cache == {}
+    main.load_child_page_cache()
+    assert main._child_page_cache == {}
+
+
+def test_concurrent_lookups_share_one_listing_of_a_parent(mock_notion):
+    mock_notion.blocks.children.list.side_effect = [
+        children_page([child("A")], "c1"),
+        children_page([child("B")]),
+    ]
+
+    async def lookups():
+        return await asyncio.gather(
+            main.find_child_page("parent", "A"), main.find_child_page("parent", "B")
+        )
+
+    assert asyncio.run(lookups()) == ["A-id", "B-id"]
+    cursors = [
+        c.kwargs["start_cursor"] for c in mock_notion.blocks.children.list.mock_calls
+    ]
+    assert cursors == [None, "c1"]
+
+
+def test_probe_http_version_reports_negotiated_protocol(mock_notion):
+    mock_notion.options.base_url = "https://api.notion.com"
+    mock_notion.client.head.return_value = httpx.Response(
+        200, extensions={"http_version": b"HTTP/2"}
+    )
+
+    assert asyncio.run(main.probe_http_version()) == "HTTP/2"
+    mock_notion.client.head.assert_called_once_with("https://api.notion.com")
+
+
+def test_warm_brand_cache_pages_existing_brands_without_creating(mock_notion):
+    existing = {
+        "hub": {"OptiMax": "optimax"},
+        "optimax": {"Brand HQ": "hq"},
+        "hq": {"Vision & Mission": "vision"},
+    }
+
+    mock_notion.blocks.children.list.side_effect = fake_child_listing(existing)
+
+    asyncio.run(main.warm_brand_cache())
+    listed = [c.kwargs["block_id"] for c in mock_notion.blocks.children.list.mock_calls]
+    assert listed == ["hub", "optimax", "hq"]
+    assert main._child_page_cache["hq"] == {"Vision & Mission": "vision"}
+    mock_notion.pages.create.assert_not_called()
+
+
+def test_invalidating_mid_listing_does_not_mark_parent_listed(mock_notion):
+    async def list_children(block_id, **kwargs):
+        main.invalidate_cache()
+        return children_page([])
+
+    mock_notion.blocks.children.list.side_effect = list_children
+
+    asyncio.run(main.page_child_pages("parent", None))
+    assert "parent" not in main._listed_parents
+    assert "parent" not in main._child_page_cursors
+
+
+@pytest.mark.parametrize(
+    "saved", [b"[]", b"null", b'{"hub": "id"}', b'{"hub": {"A": 1}}']
+)
+def test_malformed_child_page_cache_file_is_ignored(saved):
+    with open(main.CHILD_PAGE_CACHE_FILE, "wb") as f:
+        f.write(saved)
+
+    main.load_child_page_cache()
+    assert main._child_page_cache == {}
+
+
+def test_child_page_cache_file_does_not_override_live_entries():
+    with open(main.CHILD_PAGE_CACHE_FILE, "wb") as f:
+        f.write(orjson.dumps({"hub": {"A": "stale-a", "B": "b-id"}}))
+    main._child_page_cache["hub"] = {"A": "live-a"}
+
+    main.load_child_page_cache()
+    assert main._child_page_cache["hub"] == {"A": "live-a", "B": "b-id"}
+
+
+def test_refresh_log_ids_keeps_other_parents_when_never_resolved(mock_notion):
+    mock_notion.blocks.children.list.side_effect = RuntimeError("offline")
+    mock_notion.pages.create.side_effect = RuntimeError("offline")
+    main._child_page_cache["brand"] = {"Category": "category-id"}
+
+    assert asyncio.run(main.refresh_log_ids()) == {"error": "offline"}
+    assert main._child_page_cache["brand"] == {"Category": "category-id"}
+
+
+def test_shutdown_stops_warmup_listings_before_closing_client(mock_notion):
+    events = []
+    existing = {
+        "hub": {"Activity Log": "activity", "OptiMax": "optimax"},
+        "activity": {title: f"{title}-id" for title in main.LOG_PAGE_TITLES},
+    }
+
+    list_existing = fake_child_listing(existing)
+
+    async def list_children(block_id, **kwargs):
+        if block_id == "optimax":
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                events.append("listing cancelled")
+                raise
+        return await list_existing(block_id, **kwargs)
+
+    mock_notion.blocks.children.list.side_effect = list_children
+    mock_notion.aclose.side_effect = lambda: events.append("aclose")
+
+    async def serve():
+        async with main.lifespan(main.app):
+            await asyncio.sleep(0.01)
+
+    asyncio.run(serve())
+    assert events == ["listing cancelled", "aclose"]